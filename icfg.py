@@ -1,31 +1,197 @@
 import argparse
+import hashlib
+import importlib.metadata
+import json
 import os
+import pickle
+import subprocess
 import sys
-import glob
+from typing import NamedTuple
 from slither.slither import Slither
+from slither.slithir.operations import InternalCall, HighLevelCall
+
+try:
+    # Optional: orjson serializes large exports several times faster than the stdlib
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Common files that indicate a Solidity project (Hardhat/Foundry/Truffle/Brownie)
+PROJECT_INDICATORS = frozenset({
+    "hardhat.config.js",
+    "hardhat.config.ts",
+    "foundry.toml",
+    "remappings.txt",
+    "truffle-config.js",
+    "brownie-config.yaml",
+    "package.json",
+})
+
+# Directories that never hold sources of the analyzed project itself: installed
+# packages and Foundry/Hardhat/Truffle build output
+SKIPPED_DIRS = frozenset({"node_modules", "out", "cache", "artifacts", "build"})
+
+# IR operations that give rise to an inter-procedural (call -> entry) edge.
+# LibraryCall is covered as a subclass of HighLevelCall.
+CALL_TYPES = (InternalCall, HighLevelCall)
+
+# Computed ICFGs are cached here, keyed by a fingerprint of the sources.
+# Bump CACHE_VERSION whenever the shape or content of the cached graph changes.
+CACHE_DIR = os.path.join("out", ".icfg_cache")
+CACHE_VERSION = 8
+
+
+class IcfgNode(NamedTuple):
+    # One exported ICFG node. A tuple instead of a dict keeps large graphs compact
+    # and is stored as a plain [id, label, repr] array in the cache.
+    id: int
+    label: str
+    repr: str
+
+
+class IcfgEdge(NamedTuple):
+    # One exported ICFG edge, between node ids; kept as a tuple for the same reason
+    src: int
+    dst: int
 
 
 def find_sol_files(directory):
-    # recursively find .sol files
-    pattern = os.path.join(directory, "**", "*.sol")
-    return glob.glob(pattern, recursive=True)
+    # recursively find .sol files with an explicit scandir walk; hidden directories
+    # (like glob's `**`) and build/dependency output directories are not descended into
+    files = []
+    stack = [directory]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in SKIPPED_DIRS and not entry.name.startswith("."):
+                        stack.append(entry.path)
+                elif entry.name.endswith(".sol"):
+                    files.append(entry.path)
+    return sorted(files)
 
 
 def has_project_indicators(directory):
-    # Common files that indicate a Solidity project (Hardhat/Foundry/Truffle/Brownie)
-    indicators = [
-        "hardhat.config.js",
-        "hardhat.config.ts",
-        "foundry.toml",
-        "remappings.txt",
-        "truffle-config.js",
-        "brownie-config.yaml",
-        "package.json",
-    ]
-    for name in indicators:
-        if os.path.exists(os.path.join(directory, name)):
-            return True
-    return False
+    # One directory listing instead of an exists() call per indicator file
+    try:
+        return not PROJECT_INDICATORS.isdisjoint(os.listdir(directory))
+    except OSError:
+        return False
+
+
+def toolchain_versions():
+    # Versions of everything besides the sources that shapes the graph: Slither, crytic-compile
+    # and the solc found on PATH (or pinned through solc-select's SOLC_VERSION)
+    versions = []
+    for dist in ("slither-analyzer", "crytic-compile"):
+        try:
+            versions.append(importlib.metadata.version(dist))
+        except importlib.metadata.PackageNotFoundError:
+            versions.append("?")
+    solc_version = os.environ.get("SOLC_VERSION")
+    if solc_version:
+        # solc-select runs exactly this version, no need to ask the binary
+        versions.append(solc_version)
+        return versions
+    try:
+        # Short timeout: without a selected version, the solc-select shim may try to
+        # download a compiler, which can stall for a long time offline
+        solc = subprocess.run(["solc", "--version"], capture_output=True, text=True, timeout=5)
+        versions.append(solc.stdout.strip())
+    except (OSError, subprocess.SubprocessError):
+        versions.append("?")
+    return versions
+
+
+def stat_files(paths):
+    # (path, mtime, size) of every path; None stands in for a file that is gone
+    records = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            records.append((path, None, None))
+            continue
+        records.append((path, st.st_mtime_ns, st.st_size))
+    return records
+
+
+def source_fingerprint(target):
+    # Cache key of a run: the target, the toolchain versions and the project configuration
+    # files next to the target and in the working directory. For a directory target it also
+    # covers every .sol file under it, so added or removed sources change the key.
+    # The files the compilation actually read (imports from anywhere, including libraries
+    # and remapped dependencies) are recorded in the cache entry and re-checked on load.
+    target_abs = os.path.abspath(target)
+    h = hashlib.sha256(f"{CACHE_VERSION}\0{target_abs}\n".encode())
+    h.update("\0".join(toolchain_versions()).encode())
+    if os.path.isdir(target_abs):
+        config_dirs = {target_abs, os.getcwd()}
+        paths = find_sol_files(target_abs)
+    else:
+        config_dirs = {os.path.dirname(target_abs), os.getcwd()}
+        paths = []
+    for config_dir in config_dirs:
+        try:
+            names = PROJECT_INDICATORS.intersection(os.listdir(config_dir))
+        except OSError:
+            continue
+        paths += [os.path.join(config_dir, name) for name in names]
+    for path, mtime, size in stat_files(sorted(paths)):
+        h.update(f"\n{path}\0{mtime}\0{size}".encode())
+    return h.hexdigest()
+
+
+def load_cached_icfg(fingerprint):
+    path = os.path.join(CACHE_DIR, f"{fingerprint}.pickle")
+    try:
+        # Only entries written by save_cached_icfg() below are ever read from here
+        with open(path, "rb") as fh:
+            cached = pickle.load(fh)
+    except Exception:
+        # missing, truncated or incompatible cache entry — recompute
+        return None
+    # The entry records the fingerprint it was computed for; anything else is stale
+    if not isinstance(cached, dict) or cached.get("fingerprint") != fingerprint:
+        return None
+    # So is an entry whose compiled sources changed since it was written
+    sources = cached["sources"]
+    if stat_files(path for path, _, _ in sources) != sources:
+        return None
+    icfg = cached["icfg"]
+    icfg["nodes"] = [IcfgNode(*row) for row in icfg["nodes"]]
+    icfg["edges"] = [IcfgEdge(*row) for row in icfg["edges"]]
+    return icfg
+
+
+def save_cached_icfg(fingerprint, icfg, source_files):
+    # The cache is internal, so it is pickled rather than JSON-encoded: much faster to
+    # write and load, while JSON stays the format of the user-facing export.
+    # Nodes and edges are stored as plain tuples so entries don't depend on how icfg was imported.
+    path = os.path.join(CACHE_DIR, f"{fingerprint}.pickle")
+    icfg = dict(icfg, nodes=[tuple(n) for n in icfg["nodes"]], edges=[tuple(e) for e in icfg["edges"]])
+    entry = {"fingerprint": fingerprint, "sources": stat_files(sorted(source_files)), "icfg": icfg}
+    # Write to a temporary file and rename it into place, so an interrupted run
+    # never leaves a truncated entry behind
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_path, "wb") as fh:
+            pickle.dump(entry, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        # Like loading, caching is best-effort: an unwritable cache or a full disk must
+        # not cost the run its summary and exports
+        print(f"Warning: could not write the ICFG cache ({e}); continuing without it.")
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
 
 
 def create_slither(target):
@@ -36,6 +202,7 @@ def create_slither(target):
         target_abs = os.path.abspath(target)
         if has_project_indicators(target_abs):
             # crytic_compile looks for config files (like foundry.toml) in the current working directory
+            # (it records Path.cwd() on construction and takes no working-directory argument)
             # So we need to temporarily change to the target directory
             original_cwd = os.getcwd()
             try:
@@ -52,23 +219,127 @@ def create_slither(target):
             # single file — pass its path to Slither
             return Slither(sol_files[0])
         # multiple files found but no project indicators — be conservative and ask user to pick
-        print(f"Multiple Solidity files found under '{target}':")
-        for f in sol_files[:20]:
-            print("  ", f)
+        lines = [f"Multiple Solidity files found under '{target}':"]
+        lines += [f"   {f}" for f in sol_files[:20]]
         if len(sol_files) > 20:
-            print(f"  ... and {len(sol_files)-20} more files")
-        print("\nEither pass a single .sol file with --target, or run this inside a recognized project (Hardhat/Foundry/Truffle/Brownie).")
+            lines.append(f"  ... and {len(sol_files)-20} more files")
+        lines.append("\nEither pass a single .sol file with --target, or run this inside a recognized project (Hardhat/Foundry/Truffle/Brownie).")
+        print("\n".join(lines))
         sys.exit(1)
     else:
         # target is a file (or path to a single .sol). Convert to absolute path.
         return Slither(os.path.abspath(target))
 
 
+def build_icfg(sl, with_nodes=True):
+    # Build the ICFG for every implemented function and modifier of the derived
+    # contracts and every free function, and return it in its exported form: summary
+    # counts, id-labelled nodes and (src_id, dst_id) edge pairs. With `with_nodes=False`
+    # the node records (and the str(n) rendering they need) are skipped, for callers
+    # that only want the counts.
+
+    # `all_functions` holds (function, owning contract name) pairs. Modifiers and free
+    # (top-level) functions are included as well: call edges are taken from each node's
+    # own IR, so calls made inside them only reach the graph through their nodes.
+    all_functions = []
+    for contract in sl.contracts_derived:      # derived contracts, ignore interfaces
+        for f in contract.functions:
+            if not f.is_implemented:           # skip abstract
+                continue
+            all_functions.append((f, contract.name))
+    num_functions = len(all_functions)
+    for contract in sl.contracts_derived:
+        for f in contract.modifiers:
+            if f.is_implemented:
+                all_functions.append((f, contract.name))
+    num_modifiers = len(all_functions) - num_functions
+    for compilation_unit in sl.compilation_units:
+        for f in compilation_unit.functions_top_level:
+            if f.is_implemented:
+                all_functions.append((f, None))
+    num_free_functions = len(all_functions) - num_functions - num_modifiers
+
+    # IR class -> whether it is one of CALL_TYPES, filled on first sight of each class.
+    # Most IR ops are not calls, and a dict probe on type(ir) is cheaper than an
+    # isinstance() that walks their MRO; issubclass() keeps subclasses covered.
+    is_call_type = {}
+    is_call_type_get = is_call_type.get
+
+    # Single pass over every node: assign its export id, then record its
+    # intra-procedural (sons) and inter-procedural (call -> entry) successors.
+    # Successors are appended to plain lists (out-degree is tiny, so hashing every
+    # edge into a set is wasted work) and deduplicated once when edges are emitted.
+    icfg_succ = []  # node id -> list[Node]
+    node_to_id = {}
+    nodes = []
+    nid = 0
+    for f, contract_name in all_functions:
+        # All nodes of a function share its label, so build it once per function
+        label = f"{contract_name or '?'}::{f.full_name or '?'}"
+        for n in f.nodes:
+            # Every node is visited exactly once: Slither re-parses inherited functions
+            # and modifiers into a separate object (with its own nodes) per contract
+            node_to_id[n] = nid
+            if with_nodes:
+                # `str(n)` often contains a readable representation; include it for diagnostics
+                nodes.append(IcfgNode(nid, label, str(n)))
+            succ = list(n.sons)  # intra-procedural edges
+            icfg_succ.append(succ)
+            nid += 1
+            add = succ.append
+
+            # Only the node's own IR ops. all_slithir_operations() would also inline the
+            # IR of every internally called function, costing a recursive walk per node
+            # and adding shortcut edges to the callees' callees (those edges already
+            # come from the callees' own nodes).
+            for ir in n.irs:
+                # Internal (same-contract / inheritance) calls and high-level calls,
+                # including LibraryCall (a HighLevelCall subclass)
+                cls = type(ir)
+                is_call = is_call_type_get(cls)
+                if is_call is None:
+                    is_call = is_call_type[cls] = issubclass(cls, CALL_TYPES)
+                if is_call:
+                    try:
+                        entry = ir.function.entry_point
+                    except AttributeError:
+                        # callee may be unresolved (None) or, for high-level calls,
+                        # a StateVariable (public getter) or other object
+                        continue
+                    if entry:
+                        add(entry)
+
+    edges = []
+    add_edge = edges.append
+    get_id = node_to_id.get
+    total_edges = 0
+    for src_id, dsts in enumerate(icfg_succ):
+        dsts = dict.fromkeys(dsts)  # drop duplicate successors, keeping first-seen order
+        total_edges += len(dsts)
+        for dst in dsts:
+            dst_id = get_id(dst)
+            if dst_id is not None:
+                add_edge(IcfgEdge(src_id, dst_id))
+
+    return {
+        "num_functions": num_functions,
+        "num_modifiers": num_modifiers,
+        "num_free_functions": num_free_functions,
+        "num_contracts": len(sl.contracts_derived),
+        "total_nodes": nid,
+        "total_edges": total_edges,
+        "nodes": nodes,
+        "edges": edges,
+    }
+
+
 def main():
     parser = argparse.ArgumentParser(description="Build ICFG using Slither")
     parser.add_argument("--target", "-t", default=".", help="Path to a .sol file or project directory (default: .)")
     parser.add_argument("--export-json", nargs="?", const="icfg.json", help="Path to write ICFG JSON output (default: out/icfg.json)")
     parser.add_argument("--export-dot", nargs="?", const="icfg.dot", help="Path to write ICFG DOT output (default: out/icfg.dot)")
+    parser.add_argument("--cache", action="store_true", help=f"Reuse the ICFG of a previous run over unchanged sources, cached in {CACHE_DIR}/")
+    parser.add_argument("--verbose", "-v", action="store_true", help="List every ICFG node after the summary")
     args = parser.parse_args()
     
     # Ensure out/ directory exists
@@ -80,93 +351,51 @@ def main():
     if args.export_dot and not os.path.isabs(args.export_dot):
         args.export_dot = os.path.join("out", args.export_dot)
 
-    sl = create_slither(args.target)
-
-    all_functions = []
-    for contract in sl.contracts_derived:      # derived contracts, ignore interfaces
-        for f in contract.functions:
-            if not f.is_implemented:           # skip abstract
-                continue
-            all_functions.append(f)
-
-    from collections import defaultdict
-
-    icfg_succ = defaultdict(set)  # Node -> set[Node]
-
-    for f in all_functions:
-        for n in f.nodes:
-            print(f"node: {n}")  # Debug print to trace nodes
-            for son in n.sons:
-                icfg_succ[n].add(son)  # intra-procedural edge
-
-
-    from slither.slithir.operations import InternalCall, HighLevelCall
-
-    for f in all_functions:
-        for n in f.nodes:
-            for ir in n.all_slithir_operations():  # IR ops in this node
-                # Internal (same-contract / inheritance) calls
-                if isinstance(ir, InternalCall):
-                    callee = ir.function
-                    # Guard access: callee may be a StateVariable or other object
-                    entry = getattr(callee, "entry_point", None)
-                    if entry:
-                        icfg_succ[n].add(entry)
-
-                # High-level calls where Slither could resolve the target function
-                elif isinstance(ir, HighLevelCall) and ir.function is not None:
-                    callee = ir.function
-                    entry = getattr(callee, "entry_point", None)
-                    if entry:
-                        icfg_succ[n].add(entry)
-
+    # Reuse the ICFG from a previous run over identical sources: Slither re-compiles
+    # the whole project on construction, which dominates the runtime of repeated runs.
+    # Opt-in: a solc chosen by a framework's own version resolution is not part of the key
+    fingerprint = source_fingerprint(args.target) if args.cache else None
+    icfg = load_cached_icfg(fingerprint) if fingerprint else None
+    if icfg is None:
+        sl = create_slither(args.target)
+        # Node records are only needed by the exports, the verbose listing and the
+        # (opt-in) cache, so a plain summary run skips rendering every node
+        with_nodes = bool(args.export_json or args.export_dot or args.verbose or args.cache)
+        icfg = build_icfg(sl, with_nodes=with_nodes)
+        if fingerprint:
+            # The files Slither actually parsed, wherever they live (libraries, remappings)
+            save_cached_icfg(fingerprint, icfg, sl.source_code)
+    nodes = icfg["nodes"]
+    edges = icfg["edges"]
 
     # Print a small summary so the user knows we succeeded
-    print(f"Discovered {len(all_functions)} implemented functions across {len(sl.contracts_derived)} derived contracts.")
-    total_nodes = sum(len(f.nodes) for f in all_functions)
-    total_edges = sum(len(s) for s in icfg_succ.values())
-    print(f"ICFG: {total_nodes} nodes, {total_edges} intra-procedural edges.")
+    print(
+        f"Discovered {icfg['num_functions']} implemented functions across {icfg['num_contracts']} derived contracts"
+        f" (plus {icfg['num_modifiers']} modifiers and {icfg['num_free_functions']} free functions).\n"
+        f"ICFG: {icfg['total_nodes']} nodes, {icfg['total_edges']} intra-procedural edges."
+    )
+
+    # Per-node listing is opt-in: on large projects it is tens of thousands of lines
+    # and is written in one go rather than one print() per node
+    if args.verbose:
+        sys.stdout.write("".join(f"  n{n.id} {n.label}: {n.repr}\n" for n in nodes))
 
     # Export JSON / DOT if requested
     if args.export_json or args.export_dot:
-        # Build node id mapping and serializable node info
-        node_to_id = {}
-        nodes = []
-        nid = 0
-        for f in all_functions:
-            func_name = getattr(f, "full_name", None) or getattr(f, "canonical_name", None) or getattr(f, "name", None)
-            contract_name = getattr(getattr(f, "contract", None), "name", None)
-            for n in f.nodes:
-                if n in node_to_id:
-                    continue
-                node_to_id[n] = nid
-                # Use a concise label: function name + node index if available
-                # `str(n)` often contains a readable representation; include it for diagnostics
-                label = f"{contract_name or '?'}::{func_name or '?'}"
-                nodes.append({
-                    "id": nid,
-                    "label": label,
-                    "repr": str(n),
-                })
-                nid += 1
-
-        edges = []
-        for src, dsts in icfg_succ.items():
-            if src not in node_to_id:
-                # skip nodes outside the mapping (unlikely)
-                continue
-            for dst in dsts:
-                if dst not in node_to_id:
-                    continue
-                edges.append({"src": node_to_id[src], "dst": node_to_id[dst]})
-
         # Write JSON
         if args.export_json:
-            import json
-
-            out = {"nodes": nodes, "edges": edges}
-            with open(args.export_json, "w", encoding="utf-8") as fh:
-                json.dump(out, fh, indent=2, ensure_ascii=False)
+            if orjson is not None:
+                # orjson emits UTF-8 bytes with the same 2-space layout as json.dump below.
+                # It hands each IcfgNode / IcfgEdge to `default` as it goes, so no list of
+                # node or edge dicts is built alongside the records themselves.
+                out = {"nodes": nodes, "edges": edges}
+                with open(args.export_json, "wb") as fh:
+                    fh.write(orjson.dumps(out, default=lambda record: record._asdict(), option=orjson.OPT_INDENT_2))
+            else:
+                # The stdlib encoder would write the tuples as arrays, so convert up front
+                out = {"nodes": [n._asdict() for n in nodes], "edges": [e._asdict() for e in edges]}
+                with open(args.export_json, "w", encoding="utf-8") as fh:
+                    json.dump(out, fh, indent=2, ensure_ascii=False)
             print(f"Wrote ICFG JSON to {args.export_json}")
 
         # Write DOT
@@ -174,14 +403,16 @@ def main():
             def escape(s):
                 return s.replace('"', '\\"')
 
-            with open(args.export_dot, "w", encoding="utf-8") as fh:
+            # Stream the lines through one large file buffer: no per-line write() call
+            # and no full copy of the document held in memory
+            with open(args.export_dot, "w", encoding="utf-8", buffering=1 << 20) as fh:
                 fh.write("digraph ICFG {\n")
                 fh.write("  node [shape=box,fontname=\"DejaVu Sans\"];\n")
-                for n in nodes:
-                    label = escape(n["label"]) + "\\n" + escape(n["repr"])[:80]
-                    fh.write(f"  n{n['id']} [label=\"{label}\"];\n")
-                for e in edges:
-                    fh.write(f"  n{e['src']} -> n{e['dst']};\n")
+                # Truncate before escaping: cheaper on long reprs, and never cuts an escape in half
+                fh.writelines(
+                    f"  n{n.id} [label=\"{escape(n.label)}\\n{escape(n.repr[:80])}\"];\n" for n in nodes
+                )
+                fh.writelines(f"  n{src} -> n{dst};\n" for src, dst in edges)
                 fh.write("}\n")
             print(f"Wrote ICFG DOT to {args.export_dot}")
 